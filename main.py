@@ -1,16 +1,29 @@
 import os
-import json
-from dataclasses import dataclass
-from typing import Optional, Dict, Any
+import orjson
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Optional, Dict, Any, List, Literal, Tuple, Callable
+from urllib.parse import urlparse
 from pypdf import PdfReader
 from llama_cloud_services import LlamaParse
 from dotenv import load_dotenv
-import mimetypes
-from openai import OpenAI
+import diskcache
+import tiktoken
+import httpx
+import openai
+from openai import AsyncOpenAI
+from pydantic import BaseModel, Field, ValidationError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 # System prompt defined outside of functions (decoupling)
+# Keep it static and first in every request: OpenAI prompt caching matches on the exact
+# prefix, so any interpolation (timestamps, file names...) would defeat it
 SYSTEM_PROMPT = """You are a document analysis expert. Analyze the provided document content and categorize it.
 
 Document Types:
@@ -29,99 +42,401 @@ Examples:
 
 Return your analysis in the exact JSON format requested."""
 
-@dataclass
-class DocumentInfo:
+# Bump whenever SYSTEM_PROMPT, the response schema or the way document content is cut down
+# for the model changes, so cached results are invalidated
+PROMPT_VERSION = "v2"
+
+MAX_RETRY_WAIT_SECONDS = 30
+_exponential_wait = wait_exponential(multiplier=1, min=2, max=MAX_RETRY_WAIT_SECONDS)
+
+def _is_transient_error(exc: BaseException) -> bool:
+    """Rate limits, timeouts, connection drops and 5xx are worth retrying; auth/validation errors are not"""
+    if isinstance(exc, (openai.RateLimitError, openai.APIConnectionError, 
+                        openai.InternalServerError, httpx.TransportError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    # LlamaParse re-raises HTTP errors as a plain Exception chained to the original
+    if exc.__cause__ is not None:
+        return _is_transient_error(exc.__cause__)
+    return False
+
+def _wait_for_retry(retry_state) -> float:
+    """Honor the server's Retry-After header when present, otherwise back off exponentially"""
+    exc = retry_state.outcome.exception()
+    response = getattr(exc, "response", None) or getattr(exc.__cause__, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), MAX_RETRY_WAIT_SECONDS)
+            except ValueError:
+                pass
+    return _exponential_wait(retry_state)
+
+# Shared retry policy for external API calls (up to 3 attempts)
+api_retry = retry(
+    stop=stop_after_attempt(3),
+    wait=_wait_for_retry,
+    retry=retry_if_exception(_is_transient_error),
+    reraise=True
+)
+
+# Connection pool settings for the AI backend (keep-alive avoids TCP/TLS setup per request)
+HTTP_TIMEOUT_SECONDS = 60.0
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=20)
+
+# Shared async clients, one set per event loop: httpx pools are bound to the loop that opened
+# them. They live until aclose_clients() is awaited on that loop (process() does this itself).
+_LOOP_CLIENTS: Dict[asyncio.AbstractEventLoop, Dict[Tuple[Any, ...], Tuple[Any, httpx.AsyncClient]]] = {}
+
+def loop_client(key: Tuple[Any, ...], factory: Callable[[httpx.AsyncClient], Any]) -> Any:
+    """Return the shared client for key on the running loop, building it around a pooled httpx client"""
+    clients = _LOOP_CLIENTS.setdefault(asyncio.get_running_loop(), {})
+    if key not in clients:
+        http_client = httpx.AsyncClient(timeout=HTTP_TIMEOUT_SECONDS, limits=HTTP_LIMITS)
+        clients[key] = (factory(http_client), http_client)
+    return clients[key][0]
+
+async def aclose_clients() -> None:
+    """Close every shared client opened on the running event loop"""
+    clients = _LOOP_CLIENTS.pop(asyncio.get_running_loop(), {})
+    for _, http_client in clients.values():
+        await http_client.aclose()
+
+class DocumentInfo(BaseModel):
     """Response format class for OpenAI structured output"""
-    doc_type: str  # resume, letter, invoice, blog, other
-    lang_type: str  # detected language (en, es, fr, etc.)
-    summary: str   # brief summary of the document content
+    doc_type: Literal["resume", "letter", "invoice", "blog", "other"]
+    lang_type: str = Field(description="Detected language code (e.g., en, es, fr)")
+    summary: str = Field(description="Brief summary of the document content")
+
+# Request settings shared by live (parse helper) and batch (raw JSON) analysis
+ANALYSIS_TEMPERATURE = 0.1
+ANALYSIS_MAX_TOKENS = 500
+# Document token budget, leaving headroom for the system prompt and the response
+MAX_CONTENT_TOKENS = 3500
+# Rough ratio used to truncate and estimate when no tokenizer can be loaded
+CHARS_PER_TOKEN = 4
+
+# Batch request bodies are raw JSON, so they need DocumentInfo as an explicit schema
+_document_schema = DocumentInfo.model_json_schema()
+_document_schema["additionalProperties"] = False
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "document_analysis", "schema": _document_schema, "strict": True}
+}
+
+# Static message parts, built once instead of per request
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+_USER_TEMPLATE = "Analyze this document:\n\n{}"
+
+# Stable per-prompt identifier sent as prompt_cache_key so requests sharing the prefix hit the same cache
+PROMPT_CACHE_KEY = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:16]
+
+# Suffix dispatch for the formats the pipeline handles specially (cheaper than the OS mime DB)
+_FILE_KINDS = {
+    ".pdf": "pdf",
+    ".docx": "docx",
+    ".txt": "text",
+    ".md": "text",
+    ".markdown": "text",
+    ".csv": "text",
+    ".png": "image",
+    ".jpg": "image",
+    ".jpeg": "image"
+}
+
+def file_kind(file_path: str) -> str:
+    """Classify a file by suffix: pdf, docx, text, image or other"""
+    return _FILE_KINDS.get(os.path.splitext(file_path)[1].lower(), "other")
 
 class FileChecker:
     def check_file_exists(self, file_path: str) -> Dict[str, Any]:
-        if not os.path.exists(file_path):
+        # A single stat call doubles as the existence check; the result is shared with later checks
+        try:
+            stat_result = os.stat(file_path)
+        except FileNotFoundError:
             return {"error": f"File not found: {file_path}"}
-        return {"success": True}
+        except OSError as e:
+            return {"error": f"Cannot access file: {str(e)}"}
+        return {"success": True, "stat": stat_result}
 
 class PDFPageChecker:
     def __init__(self, max_pages: int = 5):
         self.max_pages = max_pages
     
     def check_pages(self, file_path: str) -> Dict[str, Any]:
-        mime_type, _ = mimetypes.guess_type(file_path)
-        if mime_type == "application/pdf":
+        if file_kind(file_path) == "pdf":
             try:
-                reader = PdfReader(file_path)
-                page_count = len(reader.pages)
-                print(f"📄 Document has {page_count} pages")
+                reader = PdfReader(file_path, strict=False)
+                page_count = self._count_pages(reader)
+                log.info("📄 Document has %d pages", page_count)
                 if page_count > self.max_pages:
                     return {"error": f"Document too long (more than {self.max_pages} pages)"}
             except Exception as e:
                 return {"error": f"Cannot read PDF: {str(e)}"}
         else:
-            print(f"🖼️ Processing non-PDF file: {file_path}")
+            log.info("🖼️ Processing non-PDF file: %s", file_path)
         
         return {"success": True}
+    
+    def _count_pages(self, reader: PdfReader) -> int:
+        """Read the page count from the page tree root instead of resolving every page object"""
+        try:
+            count = reader.trailer["/Root"]["/Pages"]["/Count"]
+            if isinstance(count, int) and count >= 0:
+                return int(count)
+        except (KeyError, TypeError, AttributeError):
+            pass
+        # Broken or missing /Count: fall back to walking the page tree
+        return len(reader.pages)
 
 class PDFSizeChecker:
     def __init__(self, max_size_mb: int = 10):
         self.max_size_mb = max_size_mb
+        self.max_size_bytes = max_size_mb * 1024 * 1024
     
-    def check_size(self, file_path: str) -> Dict[str, Any]:
-        try:
-            file_size = os.path.getsize(file_path)
-            file_size_mb = file_size / (1024 * 1024)  # Convert to MB
-            
-            if file_size_mb > self.max_size_mb:
-                return {"error": f"File too large: {file_size_mb:.2f}MB (max: {self.max_size_mb}MB)"}
-            
-            print(f"📁 File size: {file_size_mb:.2f}MB")
-            return {"success": True}
-        except Exception as e:
-            return {"error": f"Cannot check file size: {str(e)}"}
+    def check_size(self, file_size: int) -> Dict[str, Any]:
+        """Validate a file size in bytes (taken from the stat result of FileChecker)"""
+        file_size_mb = file_size / (1024 * 1024)  # Convert to MB
+        
+        if file_size > self.max_size_bytes:
+            return {"error": f"File too large: {file_size_mb:.2f}MB (max: {self.max_size_mb}MB)"}
+        
+        log.info("📁 File size: %.2fMB", file_size_mb)
+        return {"success": True}
+
+HASH_CHUNK_SIZE = 1 << 20  # 1MB
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of the file contents, used as the content part of cache keys"""
+    digest = hashlib.sha256()
+    # Stream through one reusable buffer so memory stays flat regardless of file size
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        while size := f.readinto(buffer):
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+class ResultCache:
+    """Persistent on-disk LRU cache with expiry, used for pipeline results and parse output"""
+    
+    def __init__(self, 
+                 directory: str = "./.doc_cache", 
+                 size_limit_mb: int = 512,
+                 ttl_seconds: int = 7 * 86400):
+        self.cache = diskcache.Cache(
+            directory,
+            size_limit=size_limit_mb * 1024 * 1024,
+            eviction_policy="least-recently-used"
+        )
+        self.ttl_seconds = ttl_seconds
+    
+    def get(self, key: str) -> Optional[Any]:
+        return self.cache.get(key)
+    
+    def set(self, key: str, value: Any) -> None:
+        self.cache.set(key, value, expire=self.ttl_seconds)
 
 class LlamaParseService:
-    def parse_document(self, file_path: str, api_key: str) -> Dict[str, Any]:
-        try:
-            parser = LlamaParse(
-                api_key=api_key,
+    # Born-digital PDFs with at least this much extractable text per page skip LlamaParse
+    MIN_TEXT_CHARS_PER_PAGE = 200
+    
+    # Part of the parse cache key; bump when parser settings (result_type, language...) change
+    PARSER_VERSION = "llamaparse-md-v1"
+    
+    def __init__(self, 
+                 api_key: Optional[str] = None, 
+                 cache_dir: Optional[str] = "./.parse_cache"):
+        self.api_key = api_key or os.getenv("LLAMA_CLOUD_API_KEY")
+        # Kept apart from the result cache so analyzer/prompt changes don't invalidate parses
+        self.cache = ResultCache(cache_dir, ttl_seconds=30 * 86400) if cache_dir else None
+    
+    @property
+    def parser(self) -> LlamaParse:
+        """Shared parser for this API key on the running event loop"""
+        # Reused so auth and session setup aren't repeated per file; the SDK would otherwise
+        # cache its own httpx client, which breaks once the loop that created it is closed
+        return loop_client(
+            ("llamaparse", self.api_key),
+            lambda http_client: LlamaParse(
+                api_key=self.api_key,
                 result_type="markdown",
-                verbose=True,
-                language="en"
+                verbose=False,
+                language="en",
+                # Raise on failed jobs so they reach api_retry and the error path
+                ignore_errors=False,
+                custom_client=http_client
             )
+        )
+    
+    async def parse_document(self, file_path: str, *, content_hash: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Extract the document text
+        
+        Args:
+            file_path: Document to parse
+            content_hash: hash_file() of the document, if the caller already computed it
+        """
+        try:
+            cache_key = None
+            if self.cache:
+                content_hash = content_hash or await asyncio.to_thread(hash_file, file_path)
+                cache_key = f"{content_hash}:{self.PARSER_VERSION}"
+                text = self.cache.get(cache_key)
+                if text is not None:
+                    log.info("♻️ Using cached parse (%d characters)", len(text))
+                    return {"success": True, "text": text}
             
-            result = parser.parse(file_path)
+            # Fast path: plain text and born-digital PDFs are read locally, no API round-trip
+            text = None
+            if self.can_extract_locally(file_path):
+                text = await asyncio.to_thread(self._extract_locally, file_path)
             
-            # Fixed: Handle JobResult object properly
-            if hasattr(result, 'text'):
-                # If result has text attribute directly
-                text = result.text
-            elif isinstance(result, list) and len(result) > 0:
-                # If result is a list of documents
-                text = result[0].text if hasattr(result[0], 'text') else str(result[0])
-            else:
-                # Fallback: convert to string
-                text = str(result)
+            if text is None:
+                if not self.api_key:
+                    return {"error": "LLAMA_CLOUD_API_KEY not found in environment variables"}
+                
+                result = await self._parse(file_path)
+                
+                # aparse returns a JobResult; a failed job carries its message in .error
+                if result.error:
+                    return {"error": f"LlamaParse failed: {result.error}"}
+                
+                text = "\n\n".join(page.md or page.text or "" for page in result.pages)
+                if not text.strip():
+                    return {"error": "LlamaParse returned no text"}
+                
+                # Only real parser output is cached
+                if self.cache:
+                    self.cache.set(cache_key, text)
             
-            print(f"Extracted {len(text)} characters")
+            log.info("Extracted %d characters", len(text))
             return {"success": True, "text": text}
             
         except Exception as e:
             return {"error": f"LlamaParse failed: {str(e)}"}
+    
+    def can_extract_locally(self, file_path: str) -> bool:
+        """Whether the file type may be readable without LlamaParse (see _extract_locally)"""
+        return file_kind(file_path) in ("text", "pdf")
+    
+    def _extract_locally(self, file_path: str) -> Optional[str]:
+        """Return the document text if it can be read without LlamaParse, otherwise None"""
+        kind = file_kind(file_path)
+        if kind == "text":
+            with open(file_path, encoding="utf-8", errors="replace") as f:
+                return f.read()
+        
+        if kind == "pdf":
+            try:
+                reader = PdfReader(file_path, strict=False)
+                text = "\n".join(page.extract_text() or "" for page in reader.pages)
+            except Exception:
+                # Encrypted or malformed text layer: let LlamaParse handle it
+                return None
+            
+            # Scanned/image-only PDFs have little or no text layer and need OCR
+            if len(text.strip()) >= self.MIN_TEXT_CHARS_PER_PAGE * max(len(reader.pages), 1):
+                log.info("📝 Using embedded PDF text layer")
+                return text
+        
+        return None
+    
+    @api_retry
+    async def _parse(self, file_path: str) -> Any:
+        # Read the file in a thread, then upload and wait on the job with the SDK's native
+        # async API, so the event loop is never blocked and no worker thread sits polling
+        data = await asyncio.to_thread(self._read_bytes, file_path)
+        return await self.parser.aparse(data, extra_info={"file_name": os.path.basename(file_path)})
+    
+    @staticmethod
+    def _read_bytes(file_path: str) -> bytes:
+        with open(file_path, "rb") as f:
+            return f.read()
 
 class DocumentReader:
     def read_file_data(self, file_data: str) -> Dict[str, Any]:
         if not file_data or len(file_data.strip()) == 0:
             return {"error": "No content to read"}
         
-        print(f"Reading {len(file_data)} characters of content")
+        log.info("Reading %d characters of content", len(file_data))
         return {"success": True, "content": file_data}
 
+class AsyncRateLimiter:
+    """
+    Client-side token buckets that keep requests under the API's RPM and TPM limits
+    
+    Both buckets start full and refill continuously, so bursts up to the per-minute
+    limit go out immediately and sustained throughput settles just under the cap
+    instead of triggering 429s and retry cascades. A limit set to None is not enforced.
+    """
+    
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._available_requests = float(rpm or 0)
+        self._available_tokens = float(tpm or 0)
+        self._last_refill = time.monotonic()
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.rpm:
+            self._available_requests = min(self.rpm, self._available_requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._available_tokens = min(self.tpm, self._available_tokens + elapsed * self.tpm / 60)
+    
+    async def acquire(self, tokens: int) -> None:
+        """Wait until one request and the given number of tokens fit within the limits"""
+        if self.tpm:
+            # A single request larger than the whole TPM budget still has to go out eventually
+            tokens = min(tokens, self.tpm)
+        while True:
+            self._refill()
+            requests_ok = not self.rpm or self._available_requests >= 1
+            tokens_ok = not self.tpm or self._available_tokens >= tokens
+            if requests_ok and tokens_ok:
+                if self.rpm:
+                    self._available_requests -= 1
+                if self.tpm:
+                    self._available_tokens -= tokens
+                return
+            
+            # Sleep until the scarcer of the two buckets has refilled enough
+            wait_seconds = 0.0
+            if not requests_ok:
+                wait_seconds = (1 - self._available_requests) * 60 / self.rpm
+            if not tokens_ok:
+                wait_seconds = max(wait_seconds, (tokens - self._available_tokens) * 60 / self.tpm)
+            await asyncio.sleep(wait_seconds)
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        log.warning("⚠️ Ignoring %s: expected an integer, got %r", name, value)
+        return None
+
 class GitHubAI:
     
+    # Rate limits belong to the account, so every GitHubAI with the same credentials shares
+    # one limiter (the first configuration for a key wins). The limiter holds no loop-bound
+    # state, so unlike the clients it can outlive an event loop.
+    _RATE_LIMITERS: Dict[Tuple[Optional[str], str], AsyncRateLimiter] = {}
+    
     def __init__(self, 
                  api_key: Optional[str] = None, 
                  base_url: str = "https://models.inference.ai.azure.com",
-                 model: str = "gpt-4o-mini"):
+                 model: str = "gpt-4o-mini",
+                 rpm: Optional[int] = None,
+                 tpm: Optional[int] = None):
         """
         Initialize GitHub AI
         
@@ -129,81 +444,133 @@ class GitHubAI:
             api_key: GitHub token or OpenAI API key
             base_url: GitHub Models endpoint (default) or OpenAI endpoint
             model: Model name (e.g., gpt-4o, gpt-4o-mini)
+            rpm: Requests-per-minute limit (default: OPENAI_RPM env var, unlimited if unset)
+            tpm: Tokens-per-minute limit (default: OPENAI_TPM env var, unlimited if unset)
+                 Limits are shared by all instances with the same api_key and base_url
         """
-        self.client = OpenAI(
-            api_key=api_key or os.getenv("GITHUB_TOKEN") or os.getenv("OPENAI_API_KEY"),
-            base_url=base_url
+        self.api_key = api_key or os.getenv("GITHUB_TOKEN") or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url
+        # prompt_cache_key is OpenAI-only; GitHub Models / Azure may reject unknown parameters
+        self._extra_request_args = (
+            {"prompt_cache_key": PROMPT_CACHE_KEY} if urlparse(base_url).hostname == "api.openai.com" else {}
         )
         self.model = model
+        self._encoding: Optional[tiktoken.Encoding] = None
+        self._encoding_loaded = False
+        # Token cost of the fixed parts of every prompt, used for rate limiting estimates
+        self._prompt_overhead_tokens: Optional[int] = None
+        
+        rpm = rpm or _env_int("OPENAI_RPM")
+        tpm = tpm or _env_int("OPENAI_TPM")
+        self.rate_limiter = None
+        if rpm or tpm:
+            key = (self.api_key, self.base_url)
+            if key not in GitHubAI._RATE_LIMITERS:
+                GitHubAI._RATE_LIMITERS[key] = AsyncRateLimiter(rpm, tpm)
+            self.rate_limiter = GitHubAI._RATE_LIMITERS[key]
+    
+    @property
+    def client(self) -> AsyncOpenAI:
+        """Shared client for this instance's credentials on the running event loop"""
+        # Processors with the same credentials share one connection pool
+        return loop_client(
+            ("openai", self.api_key, self.base_url),
+            lambda http_client: AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0,  # retries are handled by api_retry
+                http_client=http_client
+            )
+        )
+    
+    @property
+    def encoding(self) -> Optional[tiktoken.Encoding]:
+        """Tokenizer for the model, loaded on first use; None if it can't be loaded"""
+        if not self._encoding_loaded:
+            self._encoding_loaded = True
+            try:
+                try:
+                    self._encoding = tiktoken.encoding_for_model(self.model)
+                except KeyError:
+                    # Unknown model names (e.g. custom deployments) fall back to the gpt-4o tokenizer
+                    self._encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # tiktoken downloads its BPE file on first use, which fails when offline
+                log.warning("⚠️ Tokenizer unavailable, truncating by characters: %s", e)
+        return self._encoding
+    
+    def count_tokens(self, text: str) -> int:
+        """Token count of text, estimated from its length if no tokenizer is available"""
+        if self.encoding is None:
+            return -(-len(text) // CHARS_PER_TOKEN)
+        return len(self.encoding.encode(text, disallowed_special=()))
+    
+    def truncate(self, text: str) -> Tuple[str, int]:
+        """Truncate text to MAX_CONTENT_TOKENS tokens, returning it with its token count"""
+        if self.encoding is None:
+            content = text[:MAX_CONTENT_TOKENS * CHARS_PER_TOKEN]
+            return content, self.count_tokens(content)
+        
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= MAX_CONTENT_TOKENS:
+            return text, len(tokens)
+        return self.encoding.decode(tokens[:MAX_CONTENT_TOKENS]), MAX_CONTENT_TOKENS
+    
+    def build_messages(self, text: str) -> Tuple[List[Dict[str, str]], int]:
+        """
+        Build the chat messages for a document, shared by live and batch analysis
+        
+        Returns:
+            The messages and an estimate of their prompt tokens
+        """
+        # Truncate by tokens to avoid token limits
+        content, content_tokens = self.truncate(text)
+        
+        if self._prompt_overhead_tokens is None:
+            self._prompt_overhead_tokens = self.count_tokens(SYSTEM_PROMPT + _USER_TEMPLATE)
+        
+        messages = [_SYSTEM_MESSAGE, {"role": "user", "content": _USER_TEMPLATE.format(content)}]
+        return messages, self._prompt_overhead_tokens + content_tokens
     
-    def analyze_document(self, text: str) -> Dict[str, Any]:
+    async def analyze_document(self, text: str) -> Dict[str, Any]:
         """
         Analyze document using OpenAI response format with structured output
         """
         try:
-            # Truncate text to avoid token limits
-            content = text[:4000] if len(text) > 4000 else text
+            messages, prompt_tokens = self.build_messages(text)
             
-            # Use OpenAI's structured output with response_format
-            response = self.client.chat.completions.create(
+            # Use OpenAI's structured output; the SDK validates the reply into DocumentInfo
+            response = await self._parse_completion(
+                prompt_tokens + ANALYSIS_MAX_TOKENS,
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": f"Analyze this document:\n\n{content}"}
-                ],
-                response_format={
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "document_analysis",
-                        "schema": {
-                            "type": "object",
-                            "properties": {
-                                "doc_type": {
-                                    "type": "string",
-                                    "enum": ["resume", "letter", "invoice", "blog", "other"]
-                                },
-                                "lang_type": {
-                                    "type": "string",
-                                    "description": "Detected language code (e.g., en, es, fr)"
-                                },
-                                "summary": {
-                                    "type": "string",
-                                    "description": "Brief summary of the document content"
-                                }
-                            },
-                            "required": ["doc_type", "lang_type", "summary"],
-                            "additionalProperties": False
-                        }
-                    }
-                },
-                temperature=0.1,
-                max_tokens=500
+                messages=messages,
+                response_format=DocumentInfo,
+                temperature=ANALYSIS_TEMPERATURE,
+                max_tokens=ANALYSIS_MAX_TOKENS,
+                **self._extra_request_args
             )
             
-            # Parse the structured response
-            analysis_json = json.loads(response.choices[0].message.content)
-            
-            # Create DocumentInfo object for type safety
-            doc_info = DocumentInfo(
-                doc_type=analysis_json["doc_type"],
-                lang_type=analysis_json["lang_type"],
-                summary=analysis_json["summary"]
-            )
+            message = response.choices[0].message
+            if message.parsed is None:
+                return {"error": f"AI refused to analyze document: {message.refusal}"}
             
             return {
                 "success": True, 
-                "analysis": {
-                    "doc_type": doc_info.doc_type,
-                    "lang_type": doc_info.lang_type,
-                    "summary": doc_info.summary
-                },
+                "analysis": message.parsed.model_dump(),
                 "token_usage": response.usage.total_tokens if response.usage else 0
             }
             
-        except json.JSONDecodeError as e:
-            return {"error": f"Failed to parse AI response as JSON: {str(e)}"}
+        except ValidationError as e:
+            return {"error": f"Failed to parse AI response: {str(e)}"}
         except Exception as e:
             return {"error": f"Document analysis failed: {str(e)}"}
+    
+    @api_retry
+    async def _parse_completion(self, estimated_tokens: int, **kwargs) -> Any:
+        # Each attempt, retries included, counts against the rate limits
+        if self.rate_limiter:
+            await self.rate_limiter.acquire(estimated_tokens)
+        return await self.client.chat.completions.parse(**kwargs)
 
 class DocumentProcessor:
     """Main processor class that orchestrates the entire pipeline"""
@@ -211,25 +578,64 @@ class DocumentProcessor:
     def __init__(self, 
                  max_pages: int = 10, 
                  max_size_mb: int = 10,
-                 ai_model: str = "gpt-4o-mini"):
+                 ai_model: str = "gpt-4o-mini",
+                 cache_dir: Optional[str] = "./.doc_cache",
+                 parse_cache_dir: Optional[str] = "./.parse_cache"):
         # Initialize all components (dependency injection)
         self.file_checker = FileChecker()
         self.page_checker = PDFPageChecker(max_pages)
         self.size_checker = PDFSizeChecker(max_size_mb)
-        self.parser = LlamaParseService()
+        self.parser = LlamaParseService(cache_dir=parse_cache_dir)
         self.reader = DocumentReader()
         self.analyzer = GitHubAI(model=ai_model)
+        self.cache = ResultCache(cache_dir) if cache_dir else None
     
     def process(self, file_path: str) -> Dict[str, Any]:
+        """Process document through the entire pipeline (blocking wrapper)"""
+        async def _process_and_close() -> Dict[str, Any]:
+            try:
+                return await self.aprocess(file_path)
+            finally:
+                # asyncio.run closes the loop, so its clients can't be reused afterwards
+                await self.aclose()
+        
+        return asyncio.run(_process_and_close())
+    
+    async def aclose(self) -> None:
+        """Close the shared API clients of the running event loop; call before the loop finishes"""
+        await aclose_clients()
+    
+    async def aprocess(self, file_path: str) -> Dict[str, Any]:
         """Process document through the entire pipeline"""
         
-        # Step 1: File validation
+        # Steps 1-5: Validation, cache lookup, parsing and content reading
+        prepared = await self._prepare(file_path)
+        if "error" in prepared or "cached" in prepared:
+            return prepared.get("cached", prepared)
+        
+        # Step 6: AI analysis
+        analysis_result = await self.analyzer.analyze_document(prepared["content"])
+        if "error" in analysis_result:
+            return analysis_result
+        
+        return self._build_result(file_path, prepared, analysis_result)
+    
+    async def _prepare(self, file_path: str) -> Dict[str, Any]:
+        """
+        Run every pipeline step that comes before AI analysis
+        
+        Returns:
+            An error dict, {"cached": result} on a cache hit, or the parsed
+            content with the file size and cache key needed to build the result
+        """
+        
+        # Steps 1-2: File and size validation (both served by a single stat)
         result = self.file_checker.check_file_exists(file_path)
         if "error" in result:
             return result
+        file_size = result["stat"].st_size
         
-        # Step 2: Size validation
-        result = self.size_checker.check_size(file_path)
+        result = self.size_checker.check_size(file_size)
         if "error" in result:
             return result
         
@@ -238,12 +644,26 @@ class DocumentProcessor:
         if "error" in result:
             return result
         
-        # Step 4: Document parsing
-        api_key = os.getenv("LLAMA_CLOUD_API_KEY")
-        if not api_key:
-            return {"error": "LLAMA_CLOUD_API_KEY not found in environment variables"}
+        # Hash once for both the result cache and the parse cache
+        content_hash = None
+        if self.cache or self.parser.cache:
+            try:
+                content_hash = await asyncio.to_thread(hash_file, file_path)
+            except OSError as e:
+                # Stat-able but unreadable (directory, permissions, deleted since the stat)
+                return {"error": f"Cannot read file: {str(e)}"}
+        
+        # Cache lookup: identical content + model + prompt version skips the API calls
+        cache_key = None
+        if self.cache:
+            cache_key = f"{content_hash}:{self.analyzer.model}:{PROMPT_VERSION}"
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                log.info("♻️ Using cached result")
+                return {"success": True, "cached": {**cached, "file_path": file_path}}
         
-        parse_result = self.parser.parse_document(file_path, api_key)
+        # Step 4: Document parsing
+        parse_result = await self.parser.parse_document(file_path, content_hash=content_hash)
         if "error" in parse_result:
             return parse_result
         
@@ -252,22 +672,212 @@ class DocumentProcessor:
         if "error" in read_result:
             return read_result
         
-        # Step 6: AI analysis
-        analysis_result = self.analyzer.analyze_document(read_result["content"])
-        if "error" in analysis_result:
-            return analysis_result
-        
-        # Return comprehensive result
         return {
+            "success": True,
+            "file_size": file_size,
+            "cache_key": cache_key,
+            "content": read_result["content"]
+        }
+    
+    def _build_result(self, 
+                      file_path: str, 
+                      prepared: Dict[str, Any], 
+                      analysis_result: Dict[str, Any]) -> Dict[str, Any]:
+        """Assemble the final result and store it in the cache"""
+        result = {
             "success": True,
             "file_path": file_path,
-            "file_size_mb": round(os.path.getsize(file_path) / (1024 * 1024), 2),
-            "content_length": len(read_result["content"]),
+            "file_size_mb": round(prepared["file_size"] / (1024 * 1024), 2),
+            "content_length": len(prepared["content"]),
             "tokens_used": analysis_result.get("token_usage", 0),
             "analysis": analysis_result["analysis"]
         }
+        
+        if self.cache:
+            self.cache.set(prepared["cache_key"], result)
+        
+        return result
+    
+    async def aprocess_many(self, file_paths: List[str], concurrency: int = 10) -> List[Dict[str, Any]]:
+        """
+        Process multiple documents concurrently
+        
+        Args:
+            file_paths: Documents to process
+            concurrency: Maximum number of documents in flight at once
+        
+        Returns:
+            Results in the same order as file_paths
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _bounded(file_path: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.aprocess(file_path)
+        
+        return await asyncio.gather(*[_bounded(path) for path in file_paths])
+
+class BatchDocumentProcessor(DocumentProcessor):
+    """
+    Processor for bulk workloads that analyzes documents through the OpenAI Batch API
+    
+    Batch requests cost half as much and don't count against per-request rate
+    limits, at the price of latency (results arrive within the completion window).
+    The Batch API is only available on the OpenAI endpoint, so OPENAI_API_KEY is required.
+    """
+    
+    TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+    
+    def __init__(self, 
+                 max_pages: int = 10, 
+                 max_size_mb: int = 10,
+                 ai_model: str = "gpt-4o-mini",
+                 cache_dir: Optional[str] = "./.doc_cache",
+                 parse_cache_dir: Optional[str] = "./.parse_cache",
+                 poll_interval_seconds: float = 30,
+                 max_poll_interval_seconds: float = 300):
+        super().__init__(max_pages, max_size_mb, ai_model, cache_dir, parse_cache_dir)
+        # Never fall back to GITHUB_TOKEN: it must not be sent to api.openai.com
+        openai_api_key = os.getenv("OPENAI_API_KEY")
+        if not openai_api_key:
+            raise ValueError("OPENAI_API_KEY not found in environment variables (required for the Batch API)")
+        self.analyzer = GitHubAI(
+            api_key=openai_api_key,
+            base_url="https://api.openai.com/v1",
+            model=ai_model
+        )
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_poll_interval_seconds = max_poll_interval_seconds
+    
+    async def submit(self, file_paths: List[str], concurrency: int = 10) -> List[Dict[str, Any]]:
+        """
+        Parse documents concurrently, analyze them in one batch job and wait for the results
+        
+        Args:
+            file_paths: Documents to process
+            concurrency: Maximum number of documents parsed at once
+        
+        Returns:
+            Results in the same order as file_paths, in the same format as process()
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _bounded(file_path: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._prepare(file_path)
+        
+        prepared_docs = await asyncio.gather(*[_bounded(path) for path in file_paths])
+        
+        # Errors and cache hits are final; everything else goes into the batch
+        results: List[Dict[str, Any]] = [prepared.get("cached", prepared) for prepared in prepared_docs]
+        pending = {
+            str(index): prepared 
+            for index, prepared in enumerate(prepared_docs) 
+            if "error" not in prepared and "cached" not in prepared
+        }
+        if not pending:
+            return results
+        
+        analyses = await self._run_batch(pending)
+        for custom_id, prepared in pending.items():
+            index = int(custom_id)
+            analysis_result = analyses.get(custom_id, {"error": "No result returned by batch job"})
+            if "error" in analysis_result:
+                results[index] = analysis_result
+            else:
+                results[index] = self._build_result(file_paths[index], prepared, analysis_result)
+        
+        return results
+    
+    async def _run_batch(self, pending: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Upload the requests, wait for the batch to finish and return analyses keyed by custom_id"""
+        try:
+            # custom_id is the document's index so repeated paths don't collide
+            lines = [
+                orjson.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": self.analyzer.model,
+                        "messages": self.analyzer.build_messages(prepared["content"])[0],
+                        "response_format": RESPONSE_FORMAT,
+                        "temperature": ANALYSIS_TEMPERATURE,
+                        "max_tokens": ANALYSIS_MAX_TOKENS,
+                        "prompt_cache_key": PROMPT_CACHE_KEY
+                    }
+                })
+                for custom_id, prepared in pending.items()
+            ]
+            
+            batch_file = await self._upload(("batch_input.jsonl", b"\n".join(lines)))
+            batch = await self._create_batch(batch_file.id)
+            log.info("📦 Submitted batch %s with %d documents", batch.id, len(lines))
+            
+            # Poll with backoff until the batch reaches a terminal status
+            delay = self.poll_interval_seconds
+            while batch.status not in self.TERMINAL_STATUSES:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_poll_interval_seconds)
+                batch = await self._retrieve_batch(batch.id)
+            
+            if batch.status != "completed":
+                return {custom_id: {"error": f"Batch {batch.id} {batch.status}"} for custom_id in pending}
+            
+            # Successful requests land in the output file, failed ones in the error file
+            analyses = {}
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if not file_id:
+                    continue
+                output = await self._download(file_id)
+                for line in output.text.splitlines():
+                    if line.strip():
+                        row = orjson.loads(line)
+                        analyses[row["custom_id"]] = self._parse_batch_row(row)
+            return analyses
+            
+        except Exception as e:
+            return {custom_id: {"error": f"Batch analysis failed: {str(e)}"} for custom_id in pending}
+    
+    def _parse_batch_row(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert one line of the batch output file into an analyze_document-style result"""
+        response = row.get("response") or {}
+        if row.get("error") or response.get("status_code") != 200:
+            return {"error": f"Document analysis failed: {row.get('error') or response.get('body')}"}
+        
+        body = response["body"]
+        try:
+            doc_info = DocumentInfo.model_validate_json(body["choices"][0]["message"]["content"])
+        except ValidationError as e:
+            return {"error": f"Failed to parse AI response: {str(e)}"}
+        
+        return {
+            "success": True,
+            "analysis": doc_info.model_dump(),
+            "token_usage": (body.get("usage") or {}).get("total_tokens", 0)
+        }
+    
+    @api_retry
+    async def _upload(self, file: Any) -> Any:
+        return await self.analyzer.client.files.create(file=file, purpose="batch")
+    
+    @api_retry
+    async def _create_batch(self, input_file_id: str) -> Any:
+        return await self.analyzer.client.batches.create(
+            input_file_id=input_file_id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+    
+    @api_retry
+    async def _retrieve_batch(self, batch_id: str) -> Any:
+        return await self.analyzer.client.batches.retrieve(batch_id)
+    
+    @api_retry
+    async def _download(self, file_id: str) -> Any:
+        return await self.analyzer.client.files.content(file_id)
 
-def main():
+async def main():
     """Main execution function"""
     # Configuration
     FILE_PATH = "C:/Users/karth/Vinoth/test_documents/Chekuri, Karthik - Resume (1) (1).docx"  # Change to your document path
@@ -275,6 +885,8 @@ def main():
     MAX_SIZE_MB = 10
     AI_MODEL = "gpt-4o-mini"  
     
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    
     # Initialize processor
     processor = DocumentProcessor(
         max_pages=MAX_PAGES,
@@ -283,14 +895,17 @@ def main():
     )
     
     # Process document
-    print(f"🚀 Processing document: {FILE_PATH}")
-    result = processor.process(FILE_PATH)
+    log.info("🚀 Processing document: %s", FILE_PATH)
+    try:
+        result = await processor.aprocess(FILE_PATH)
+    finally:
+        await processor.aclose()
     
     # Output results
     print("\n" + "="*50)
     print("DOCUMENT ANALYSIS RESULTS")
     print("="*50)
-    print(json.dumps(result, indent=2, ensure_ascii=False))
+    print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())